@@ -1,33 +1,171 @@
-import requests
+import httpx
 import os
+import functools
+import contextlib
 import hashlib
-import mimetypes
-from urllib.parse import urlparse
+import importlib.util
+import json
+import re
+import mmap
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import ParseResult, urlparse
 from pathlib import Path
 import time
 
+# Anything outside this ASCII whitelist is stripped from saved filenames
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9 ._-]")
+_WHITESPACE = re.compile(r"\s+")
+
+# An http(s) URL with a host; cheaper than a full urlparse() for validation
+_URL_RE = re.compile(r"^https?://[^/\s]+(/\S*)?$", re.IGNORECASE)
+
+# Extensions for the image types we expect; avoids mimetypes' lazy system
+# table scan and its odd picks (e.g. ".jpe" for image/jpeg)
+_IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+    "image/svg+xml": ".svg",
+    "image/bmp": ".bmp",
+    "image/tiff": ".tiff",
+}
+
+# HTTP/2 support in httpx needs the optional h2 package (pip install httpx[http2])
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Permissions for saved images, honouring the umask like open() does
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+_FILE_MODE = 0o666 & ~_UMASK
+
+@functools.lru_cache(maxsize=4096)
+def _parse_url(url):
+    """urlparse() memoized, so repeated URLs in a run are parsed once"""
+    return urlparse(url)
+
+class _TeeWriter:
+    """File-like wrapper that hashes and counts bytes as they are written"""
+    
+    def __init__(self, fp, hasher, max_size):
+        self._fp = fp
+        self.hasher = hasher
+        self.size = 0
+        self.max_size = max_size
+    
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        # Safety check: don't download more than max_size
+        if self.size > self.max_size:
+            raise ValueError(f"File too large (over {self.max_size // (1024 * 1024)}MB)")
+        return self._fp.write(data)
+
 class UbuntuImageFetcher:
-    def __init__(self):
+    # Hash family tag, so digests from different algorithms never compare equal
+    HASH_PREFIX = b"b2:"
+    
+    def __init__(self, max_workers=8, requests_per_second=1.0):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be greater than 0")
+        
+        # Raw digests (not hex strings) of every image on disk
         self.downloaded_hashes = set()
         self.fetched_dir = "Fetched_Images"
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        
+        # Shared client so repeated hosts reuse connections; with HTTP/2 (when
+        # the optional h2 package is installed) requests to one host are
+        # multiplexed over a single connection
+        self.session = httpx.Client(
+            timeout=15,
+            follow_redirects=True,
+            headers={'User-Agent': 'UbuntuImageFetcher/1.0 (Community Image Collector)'},
+            transport=httpx.HTTPTransport(
+                http2=_HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                retries=2,
+            ),
+        )
         
+        # Guards duplicate detection, filename reservation and user prompts
+        # across worker threads
+        self._hash_lock = threading.Lock()
+        self._prompt_lock = threading.Lock()
+
+        # Set on Ctrl-C so worker threads stop picking up new URLs
+        self._stop_event = threading.Event()
+
+        # Per-host rate limiting: netloc -> earliest time of the next request
+        self._host_next_time = {}
+        self._host_lock = threading.Lock()
+
+        # Per-thread buffer of status lines for the download in progress
+        self._output = threading.local()
+
+        # Names of files already in fetched_dir, filled by create_directory;
+        # _existing_names also grows as this run reserves new names, while
+        # _names_on_disk stays a snapshot of files from earlier runs
+        self._existing_names = set()
+        self._names_on_disk = frozenset()
+
+        # url -> {"etag", "last_modified", "hash", "path"} for conditional GETs
+        self.etag_cache = {}
+        self._etags_by_path = {}
+        self.etag_cache_file = os.path.join(self.fetched_dir, ".etags.json")
+
     def create_directory(self):
         """Create the directory for storing images"""
         os.makedirs(self.fetched_dir, exist_ok=True)
         print(f"✓ Directory '{self.fetched_dir}' is ready")
+        with os.scandir(self.fetched_dir) as entries:
+            self._existing_names = {entry.name for entry in entries if entry.is_file()}
+        self._names_on_disk = frozenset(self._existing_names)
+        self.load_etag_cache()
+
+    def load_etag_cache(self):
+        """Load cached ETag/Last-Modified validators from previous runs"""
+        try:
+            with open(self.etag_cache_file, 'r', encoding='utf-8') as f:
+                self.etag_cache = json.load(f)
+        except (OSError, ValueError):
+            # Missing or corrupt cache just means full downloads this run
+            self.etag_cache = {}
+        # Saved path -> ETag, to check a HEAD against the file on disk
+        self._etags_by_path = {
+            entry['path']: entry['etag']
+            for entry in self.etag_cache.values() if entry.get('etag')
+        }
+
+    def save_etag_cache(self):
+        """Persist ETag/Last-Modified validators for the next run"""
+        # Snapshot under the lock; workers may still be adding entries
+        with self._hash_lock:
+            etag_cache = dict(self.etag_cache)
+        try:
+            with open(self.etag_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(etag_cache, f, indent=2)
+        except OSError as e:
+            print(f"⚠ Warning: Could not save ETag cache: {e}")
     
     def validate_url(self, url):
         """Basic URL validation"""
-        parsed = urlparse(url)
-        if not all([parsed.scheme, parsed.netloc]):
+        if not _URL_RE.match(url):
+            scheme, separator, _ = url.partition('://')
+            if separator and scheme.lower() not in ('http', 'https'):
+                raise ValueError("Only HTTP/HTTPS URLs are supported")
             raise ValueError("Invalid URL format")
-        if parsed.scheme not in ['http', 'https']:
-            raise ValueError("Only HTTP/HTTPS URLs are supported")
         return True
     
     def get_filename_from_url(self, url, content_type=None):
-        """Extract or generate appropriate filename"""
-        parsed = urlparse(url)
+        """Extract or generate appropriate filename (url may be pre-parsed)"""
+        parsed = url if isinstance(url, ParseResult) else _parse_url(url)
         filename = os.path.basename(parsed.path)
         
         if not filename or '.' not in filename:
@@ -44,9 +182,8 @@ class UbuntuImageFetcher:
     def get_extension_from_content_type(self, content_type):
         """Get file extension from content type"""
         if content_type:
-            extension = mimetypes.guess_extension(content_type.split(';')[0])
-            if extension:
-                return extension
+            mime_type = content_type.split(';', 1)[0].strip().lower()
+            return _IMAGE_EXTENSIONS.get(mime_type, ".jpg")
         
         # Default extension if content type is unknown
         return ".jpg"
@@ -55,26 +192,75 @@ class UbuntuImageFetcher:
         """Sanitize filename to prevent path traversal and special characters"""
         # Remove directory traversal attempts
         filename = os.path.basename(filename)
-        # Replace potentially problematic characters
-        filename = "".join(c for c in filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-        return filename or "downloaded_image.jpg"
+        # Replace potentially problematic characters and collapse whitespace runs
+        filename = _WHITESPACE.sub(' ', _UNSAFE_FILENAME_CHARS.sub('', filename)).rstrip()
+        if not filename or filename.startswith('.'):
+            # Nothing usable left of the stem (e.g. a non-ASCII name became
+            # ".png"); don't save a hidden file, but keep the extension
+            extension = os.path.splitext('x' + filename)[1]
+            if extension in ('', '.'):
+                extension = ".jpg"
+            filename = f"downloaded_image{extension}"
+        return filename
+    
+    def new_hasher(self):
+        """Create a fresh hasher for duplicate detection (BLAKE2b, 16-byte digest)"""
+        # Not a security boundary; lets FIPS-mode OpenSSL builds use the fast path
+        return hashlib.blake2b(digest_size=16, usedforsecurity=False)
     
     def calculate_file_hash(self, content):
-        """Calculate MD5 hash of file content for duplicate detection"""
-        return hashlib.md5(content).hexdigest()
+        """Calculate BLAKE2b hash of file content for duplicate detection"""
+        hasher = self.new_hasher()
+        hasher.update(content)
+        return self.HASH_PREFIX + hasher.digest()
     
     def is_duplicate(self, content_hash):
         """Check if file has already been downloaded"""
         return content_hash in self.downloaded_hashes
     
+    def add_hash(self, content_hash):
+        """Record a downloaded file's hash for duplicate detection"""
+        self.downloaded_hashes.add(content_hash)
+    
+    def _hash_file(self, path):
+        """Hash a file on disk via mmap, so it is never read into a bytes object"""
+        try:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # mmap refuses empty files
+                    return self.calculate_file_hash(b'')
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # One front-to-back pass; let the kernel read ahead aggressively
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    return self.calculate_file_hash(mm)
+        except (OSError, ValueError):
+            return None
+    
+    def _hash_many(self, paths):
+        """Hash many files at once; returns {path: hash}, skipping unreadable files"""
+        # Files are independent, and hashlib releases the GIL while hashing,
+        # so one thread per core hashes that many files truly in parallel
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            hashes = executor.map(self._hash_file, paths)
+            return {path: content_hash for path, content_hash in zip(paths, hashes) if content_hash}
+    
+    def _is_internal_file(self, name):
+        """Whether a file in fetched_dir is bookkeeping rather than an image"""
+        if name == os.path.basename(self.etag_cache_file):
+            return True
+        return name.startswith('.') and name.endswith('.part')
+    
     def load_existing_hashes(self):
         """Load hashes of already downloaded files"""
         try:
-            for file in Path(self.fetched_dir).glob('*'):
-                if file.is_file():
-                    with open(file, 'rb') as f:
-                        content = f.read()
-                        self.downloaded_hashes.add(self.calculate_file_hash(content))
+            # Skip this tool's own files (in-progress .part downloads, ETag cache)
+            paths = [
+                file for file in Path(self.fetched_dir).iterdir()
+                if file.is_file() and not self._is_internal_file(file.name)
+            ]
+            for content_hash in self._hash_many(paths).values():
+                self.add_hash(content_hash)
         except Exception:
             # If we can't load existing hashes, continue without duplicate checking
             pass
@@ -90,7 +276,7 @@ class UbuntuImageFetcher:
         # Check if content type is an image
         content_type = headers_to_check['Content-Type'].lower()
         if not content_type.startswith('image/'):
-            print(f"⚠ Warning: Content-Type is '{content_type}', expected an image")
+            self._log(f"⚠ Warning: Content-Type is '{content_type}', expected an image")
             # Ask for confirmation to continue
             if not self.confirm_download("This doesn't appear to be an image. Continue?"):
                 raise ValueError("Download cancelled by user")
@@ -108,92 +294,288 @@ class UbuntuImageFetcher:
     
     def confirm_download(self, message):
         """Ask user for confirmation"""
-        response = input(f"{message} (y/N): ").lower().strip()
+        with self._prompt_lock:
+            # The user needs to see the buffered context before the prompt
+            self._flush_log()
+            response = input(f"{message} (y/N): ").lower().strip()
         return response in ['y', 'yes']
     
+    def _log(self, message):
+        """Print a status line, or buffer it while a download is in progress"""
+        lines = getattr(self._output, 'lines', None)
+        if lines is None:
+            print(message)
+        else:
+            lines.append(message)
+    
+    def _flush_log(self):
+        """Write this thread's buffered status lines with a single write"""
+        lines = getattr(self._output, 'lines', None)
+        if lines:
+            sys.stdout.write('\n'.join(lines) + '\n')
+            sys.stdout.flush()
+            lines.clear()
+    
+    @contextlib.contextmanager
+    def _buffered_output(self):
+        """Collect status lines and emit them together (nested use is a no-op)"""
+        if getattr(self._output, 'lines', None) is not None:
+            yield
+            return
+        self._output.lines = []
+        try:
+            yield
+        finally:
+            self._flush_log()
+            self._output.lines = None
+    
+    def _wait_for_host(self, netloc):
+        """Block until the next request to this host is allowed"""
+        interval = 1.0 / self.requests_per_second
+        with self._host_lock:
+            now = time.monotonic()
+            # Reserve the next slot for this host before sleeping, so
+            # concurrent callers queue up behind each other
+            start = max(now, self._host_next_time.get(netloc, 0))
+            self._host_next_time[netloc] = start + interval
+        time.sleep(start - now)
+    
+    def _drop_page_cache(self, f):
+        """Hint the OS that a just-written image won't be read again soon"""
+        # Keeps long runs from evicting more useful pages; Linux only
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        try:
+            # DONTNEED only drops clean pages, so write them back first
+            f.flush()
+            os.fdatasync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+    
+    def _reserve_filename(self, filename):
+        """Pick an unused name (adding _N if needed) and mark it as taken"""
+        with self._hash_lock:
+            if filename in self._existing_names:
+                base_name, extension = os.path.splitext(filename)
+                pattern = re.compile(rf"^{re.escape(base_name)}_(\d+){re.escape(extension)}$")
+                counters = [
+                    int(match.group(1))
+                    for match in map(pattern.match, self._existing_names) if match
+                ]
+                filename = f"{base_name}_{max(counters, default=0) + 1}{extension}"
+            self._existing_names.add(filename)
+        return filename
+    
+    def _matches_existing_file(self, url, parsed):
+        """HEAD the URL and check whether its file is already on disk"""
+        # Only files from earlier runs; names saved this run may belong to
+        # a different image from another host
+        filename = self.sanitize_filename(os.path.basename(parsed.path))
+        if '.' not in filename or filename not in self._names_on_disk:
+            return None
+        
+        filepath = os.path.join(self.fetched_dir, filename)
+        try:
+            response = self.session.head(url)
+            response.raise_for_status()
+            content_length = int(response.headers['Content-Length'])
+            cached_etag = self._etags_by_path.get(filepath)
+            etag_matches = cached_etag is None or response.headers.get('ETag') == cached_etag
+            if etag_matches and content_length == os.path.getsize(filepath):
+                return filepath
+        except (httpx.HTTPError, KeyError, ValueError, OSError):
+            # No usable answer; fall back to a full download
+            pass
+        # The HEAD used this host's slot; wait again before the GET
+        self._wait_for_host(parsed.netloc)
+        return None
+    
     def download_image(self, url):
         """Download a single image with safety checks"""
+        with self._buffered_output():
+            return self._download_image(url)
+    
+    def _download_image(self, url):
+        """Download a single image; status lines go through self._log"""
         try:
             # Validate URL
             self.validate_url(url)
             
-            # Make request with safe headers and timeout
-            headers = {
-                'User-Agent': 'UbuntuImageFetcher/1.0 (Community Image Collector)'
-            }
-            
-            print(f"🔗 Connecting to: {urlparse(url).netloc}")
-            response = requests.get(url, headers=headers, timeout=15, stream=True)
-            response.raise_for_status()
-            
-            # Check HTTP headers for safety
-            http_info = self.check_http_headers(response)
-            
-            # Read content in chunks for large files
-            content = b''
-            for chunk in response.iter_content(chunk_size=8192):
-                content += chunk
-                # Safety check: don't download more than 100MB
-                if len(content) > 100 * 1024 * 1024:
-                    raise ValueError("File too large (over 100MB)")
-            
-            # Check for duplicates
-            content_hash = self.calculate_file_hash(content)
-            if self.is_duplicate(content_hash):
-                print("✓ Image already downloaded (duplicate detected)")
-                return None
-            
-            # Get appropriate filename
-            filename = self.get_filename_from_url(url, http_info['Content-Type'])
-            filepath = os.path.join(self.fetched_dir, filename)
-            
-            # Ensure unique filename
-            counter = 1
-            base_name, extension = os.path.splitext(filename)
-            while os.path.exists(filepath):
-                filename = f"{base_name}_{counter}{extension}"
-                filepath = os.path.join(self.fetched_dir, filename)
-                counter += 1
+            parsed = _parse_url(url)
             
-            # Save the image
-            with open(filepath, 'wb') as f:
-                f.write(content)
+            # Be respectful to servers
+            self._wait_for_host(parsed.netloc)
             
-            # Add to downloaded hashes
-            self.downloaded_hashes.add(content_hash)
+            # Revalidate against a previous download instead of refetching it
+            headers = {}
+            cached = self.etag_cache.get(url)
+            if not cached:
+                # No validators to send; a same-named, same-sized file on
+                # disk is taken as this image without fetching the body
+                existing_path = self._matches_existing_file(url, parsed)
+                if existing_path:
+                    self._log(f"✓ Image already downloaded: {existing_path}")
+                    return existing_path
+            if cached and os.path.exists(cached.get('path', '')):
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+            # Make request through the shared client (safe headers set there)
+            self._log(f"🔗 Connecting to: {parsed.netloc}")
+            with self.session.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    self._log("✓ Image not modified since last download")
+                    with self._hash_lock:
+                        if cached.get('hash'):
+                            self.add_hash(bytes.fromhex(cached['hash']))
+                    return cached['path']
+                response.raise_for_status()
+                
+                # Check HTTP headers for safety
+                http_info = self.check_http_headers(response)
+                
+                # Stream straight to a temp file, hashing as we go, so the whole
+                # image never has to sit in memory. iter_bytes() yields decoded
+                # (gzip/brotli) data; the tee hashes and size-checks each block
+                tmp = tempfile.NamedTemporaryFile(dir=self.fetched_dir, prefix='.', suffix='.part', delete=False)
+                try:
+                    with tmp:
+                        writer = _TeeWriter(tmp, self.new_hasher(), max_size=100 * 1024 * 1024)
+                        for chunk in response.iter_bytes(chunk_size=1024 * 1024):
+                            writer.write(chunk)
+                        hasher = writer.hasher
+                        file_size = writer.size
+                        self._drop_page_cache(tmp)
+                except BaseException:
+                    os.unlink(tmp.name)
+                    raise
             
-            print(f"✓ Successfully fetched: {filename}")
-            print(f"✓ Image saved to {filepath}")
+            try:
+                # Check for duplicates
+                content_hash = self.HASH_PREFIX + hasher.digest()
+                with self._hash_lock:
+                    if self.is_duplicate(content_hash):
+                        self._log("✓ Image already downloaded (duplicate detected)")
+                        return None
+                    # Claim the hash now so a concurrent worker sees the duplicate
+                    self.add_hash(content_hash)
+                
+                placeholder = None
+                try:
+                    # Get appropriate filename
+                    filename = self.get_filename_from_url(parsed, http_info['Content-Type'])
+                    
+                    # Ensure unique filename; 'x' mode still guards against
+                    # files created outside this process since startup
+                    while True:
+                        filename = self._reserve_filename(filename)
+                        filepath = os.path.join(self.fetched_dir, filename)
+                        try:
+                            open(filepath, 'xb').close()
+                            placeholder = filepath
+                            break
+                        except FileExistsError:
+                            pass
+                    
+                    # Save the image; temp files are created 0600, so give it
+                    # the mode a plain open() would have
+                    os.chmod(tmp.name, _FILE_MODE)
+                    os.replace(tmp.name, filepath)
+                    placeholder = None
+                except Exception:
+                    # Don't leave an empty placeholder behind; it would be
+                    # hashed as a real image on the next start
+                    if placeholder and os.path.exists(placeholder):
+                        os.unlink(placeholder)
+                    with self._hash_lock:
+                        self.downloaded_hashes.discard(content_hash)
+                        if placeholder:
+                            self._existing_names.discard(filename)
+                    raise
+            finally:
+                # Drop the partial/duplicate download if it wasn't moved into place
+                if os.path.exists(tmp.name):
+                    os.unlink(tmp.name)
+
+            # Remember validators so the next run can send a conditional GET
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                with self._hash_lock:
+                    self.etag_cache[url] = {
+                        'etag': etag,
+                        'last_modified': last_modified,
+                        'hash': content_hash.hex(),
+                        'path': filepath,
+                    }
+
+            self._log(f"✓ Successfully fetched: {filename}")
+            self._log(f"✓ Image saved to {filepath}")
             
-            file_size = len(content)
-            print(f"✓ File size: {file_size/1024:.1f}KB")
+            self._log(f"✓ File size: {file_size/1024:.1f}KB")
             
             return filepath
             
-        except requests.exceptions.RequestException as e:
-            print(f"✗ Connection error: {e}")
+        except httpx.HTTPError as e:
+            self._log(f"✗ Connection error: {e}")
         except ValueError as e:
-            print(f"✗ Validation error: {e}")
+            self._log(f"✗ Validation error: {e}")
         except Exception as e:
-            print(f"✗ An unexpected error occurred: {e}")
+            self._log(f"✗ An unexpected error occurred: {e}")
         
         return None
     
     def download_multiple_images(self, urls):
         """Download multiple images from a list of URLs"""
-        successful_downloads = 0
-        
+        # Group URLs by host so each server sees one request at a time
+        hosts = {}
         for i, url in enumerate(urls, 1):
             url = url.strip()
             if not url:
                 continue
-                
-            print(f"\n--- Downloading image {i}/{len(urls)} ---")
-            result = self.download_image(url)
-            if result:
-                successful_downloads += 1
-            print("-" * 40)
-            time.sleep(1)  # Be respectful to servers
+            hosts.setdefault(_parse_url(url).netloc, []).append((i, url))
+        
+        self._stop_event.clear()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [
+                executor.submit(self._download_host_queue, queue, len(urls))
+                for queue in hosts.values()
+            ]
+            successful_downloads = sum(future.result() for future in futures)
+        except KeyboardInterrupt:
+            # Stop workers after their current URL and drop queued hosts,
+            # instead of waiting for every remaining download
+            self._stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            # Let in-flight downloads finish so their results (and ETag
+            # cache entries) are complete; a second Ctrl-C stops waiting
+            print("\n⏳ Finishing downloads in progress (Ctrl-C again to skip)...")
+            try:
+                executor.shutdown(wait=True)
+            except KeyboardInterrupt:
+                pass
+            raise
+        executor.shutdown()
+        return successful_downloads
+    
+    def _download_host_queue(self, queue, total):
+        """Download one host's URLs serially"""
+        successful_downloads = 0
+        
+        for i, url in queue:
+            if self._stop_event.is_set():
+                break
+            # Header, status lines and separator go out in one write
+            with self._buffered_output():
+                self._log(f"\n--- Downloading image {i}/{total} ---")
+                result = self.download_image(url)
+                if result:
+                    successful_downloads += 1
+                self._log("-" * 40)
         
         return successful_downloads
     
@@ -238,7 +620,11 @@ def main():
         print(f"\nStarting download of {len(urls)} image(s)...")
         
         # Download images
-        successful = fetcher.download_multiple_images(urls)
+        try:
+            successful = fetcher.download_multiple_images(urls)
+        finally:
+            # Keep validators from completed downloads, even if interrupted
+            fetcher.save_etag_cache()
         
         # Summary
         print("\n" + "=" * 60)